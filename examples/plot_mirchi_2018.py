@@ -14,36 +14,33 @@ manuscript.
 # for the Mirchi et al., 2018 paper; this will, by default, download the
 # relevant data and cache it in ~/nnt-data/ds-mirchi2018. If another directory
 # is preferred you can specify the path with the ``data_dir`` parameter.
+#
+# By default the ``Y`` matrix is returned as a structured numpy array where
+# each column has its own datatype (i.e., a different subscore measure). To
+# perform normal matrix operations on it we need it to be a standard
+# "unstructured" array, so we'll ask the fetcher to give it to us that way
+# (along with the names of the PANAS measures, so we can use them to plot
+# things later!).
 
 from netneurotools.datasets import fetch_mirchi2018
 
-X, Y = fetch_mirchi2018(data_dir=None, verbose=0)
+X, Y, panas_measures = fetch_mirchi2018(data_dir=None, verbose=0,
+                                        return_structured=False)
 print('MyConnectome sessions: {}'.format(len(X)),
       'Functional connectivity edges: {}'.format(X.shape[-1]),
-      'PANAS sub-scores: {}'.format(len(Y.dtype)), sep='\n')
+      'PANAS sub-scores: {}'.format(len(panas_measures)), sep='\n')
 
 ###############################################################################
 # We see that we have 73 sessions of data from the MyConnectome project. The
 # ``X`` matrix represents functional correlations between regions of interest
 # and the``Y`` matrix represents PANAS subscore measures.
 #
-# First, we'll need to convert the ``Y`` matrix to a slightly more usable
-# format. It's returned from the function as a structured numpy array where
-# each column has its own datatype (i.e., a different subscore measure). To
-# perform normal matrix operations on it we need it to be an standard
-# "unstructured" array. We'll save the PANAS measure names before converting so
-# we can use them to plot things later!
-#
-# Once we convert the ``Y`` matrix we need to z-score the data. This will
-# ensure that the results of our PLS decomposition can be interpreted as
-# correlations (rather than covariances), making deriving inferences from the
-# data much easier.
+# First, we need to z-score the data. This will ensure that the results of our
+# PLS decomposition can be interpreted as correlations (rather than
+# covariances), making deriving inferences from the data much easier.
 
-from numpy.lib.recfunctions import structured_to_unstructured
 from scipy.stats import zscore
 
-panas_measures = list(Y.dtype.fields)
-Y = structured_to_unstructured(Y)
 Xz = zscore(X, ddof=1)
 Yz = zscore(Y, ddof=1)
 
@@ -57,7 +54,7 @@ Yz = zscore(Y, ddof=1)
 # We can decompose that matrix using an SVD to generate left and right singular
 # vectors (``U`` and ``V``) and a diagonal array of singular values (``sval``).
 
-from scipy.linalg import svd
+from scipy.linalg import polar, svd
 
 cross_corr = (Yz.T @ Xz) / (len(Xz) - 1)
 U, sval, V = svd(cross_corr.T, full_matrices=False)
@@ -78,14 +75,21 @@ print('U shape: {}'.format(U.shape),
 # correlations are low then we should interpret the results of the PLS with
 # caution.
 
-from scipy.stats import pearsonr
+from scipy.stats import t
 
 # Project samples to the derived space
 x_scores, y_scores = Xz @ U, Yz @ V
 
-for comp in range(x_scores.shape[-1]):
-    # Correlate the sample scores for each component
-    corr = pearsonr(x_scores[:, comp], y_scores[:, comp])
+# Correlate the sample scores for each component. Once the scores are z-scored
+# this is just the (scaled) sum of their element-wise product, so we can do
+# all the components at once. We get two-sided p-values for the correlations
+# from a t-distribution, the same way :py:func:`scipy.stats.pearsonr` does.
+corrs = (zscore(x_scores, ddof=1) * zscore(y_scores, ddof=1)).sum(axis=0)
+corrs /= len(x_scores) - 1
+dof = len(x_scores) - 2
+pvals = 2 * t.sf(abs(corrs) * (dof / (1 - corrs ** 2)) ** 0.5, dof)
+
+for comp, corr in enumerate(zip(corrs, pvals)):
     print('Component {:>2}: r = {:.2f}, p = {:.3f}'.format(comp, *corr))
 
 ###############################################################################
@@ -149,28 +153,55 @@ import numpy as np
 n_perm = 500
 rs = np.random.RandomState(1234)  # Set a random seed for reproducibility
 
-sval_perm = np.zeros((len(varexp), n_perm))
-
-for n in range(n_perm):
-
-    # Permute and z-score the Y matrix (leaving the X matrix intact)
-    resamp = rs.permutation(len(Y))
-    Ypz = zscore(Y[resamp], ddof=1)
-
-    # Regenerate the cross-correlation matrix and compute the decomposition
-    cross_corr = (Ypz.T @ Xz) / (len(Xz) - 1)
-    U_new, sval_new, V_new = svd(cross_corr.T, full_matrices=False)
-    V_new = V_new.T
-
-    # Align the new singular vectors to the original using Procrustes. We can
-    # do this with EITHER the left or right singular vectors; we'll use the
-    # left vectors since they're much smaller in size so this is more
-    # computationally efficient.
-    N, _, P = svd(V.T @ V_new, full_matrices=False)
-    aligned = V_new @ np.diag(sval_new) @ (P.T @ N.T)
+# The permutation and bootstrap procedures are the most computationally
+# demanding parts of this analysis. They're dominated by moving our (big!) data
+# matrices around in memory, and since we're estimating null / sampling
+# distributions we don't need the full precision of 64-bit floats. We'll use
+# 32-bit copies of our data for these procedures, which halves the memory
+# traffic and lets NumPy use faster single-precision routines.
+X32, Y32 = X.astype(np.float32), Y.astype(np.float32)
+Xz32, Yz32 = Xz.astype(np.float32), Yz.astype(np.float32)
+
+# Rather than looping over permutations one at a time we can generate all of
+# them at once (as shuffling indices) and do the rest of the computations in a
+# "batched" fashion, which is much faster than a Python loop over lots of
+# small matrices. Shuffling the rows of ``Y`` doesn't change its column means
+# or standard deviations, so we can simply shuffle the already z-scored data.
+resamp = rs.random_sample((n_perm, len(Y))).argsort(axis=1)
+Ypz = Yz32[resamp]
+
+# Holding all the permuted cross-correlation matrices in memory at once would
+# be prohibitive (they're each PANAS subscores x functional connections), but
+# we only need their singular values and right singular vectors. These can be
+# obtained from the much smaller PANAS x PANAS "Gram" matrix of each permuted
+# cross-correlation matrix, ``cross_corr @ cross_corr.T``. Since the
+# cross-correlation matrix is ``Ypz.T @ Xz / (N - 1)``, we can generate all the
+# Gram matrices from the tiny session x session matrix ``Xz @ Xz.T`` without
+# ever forming the big matrices! (We make a contiguous copy of the transposed
+# permuted data so NumPy can hand it straight to BLAS, rather than copying the
+# strided view for every permutation in the stack.)
+XXt = (Xz32 @ Xz32.T) / ((len(Xz) - 1) ** 2)
+Ypz_t = np.ascontiguousarray(Ypz.transpose(0, 2, 1))
+gram = Ypz_t @ XXt @ Ypz
+
+# The singular values of the Gram matrices are the squared singular values of
+# the cross-correlation matrices, and the singular vectors are the (right)
+# singular vectors we're after. NumPy will decompose the whole stack at once.
+V_new, sval_new, _ = np.linalg.svd(gram)
+sval_new = np.sqrt(sval_new)
+
+# Align the new singular vectors to the original using Procrustes. We can
+# do this with EITHER the left or right singular vectors; we'll use the
+# right vectors since they're much smaller in size so this is more
+# computationally efficient.
+#
+# The Procrustes rotation is the (transposed) orthogonal factor of the polar
+# decomposition of ``V.T @ V_new``, which we can get from its SVD as ``N @ P``.
+N, _, P = np.linalg.svd(V.T @ V_new)
+aligned = (V_new * sval_new[:, None]) @ (N @ P).transpose(0, 2, 1)
 
-    # Calculate the singular values for the rotated, permuted component space
-    sval_perm[:, n] = np.sqrt(np.sum(aligned ** 2, axis=0))
+# Calculate the singular values for the rotated, permuted component space
+sval_perm = np.sqrt(np.sum(aligned ** 2, axis=1)).T
 
 # Calculate the number of permuted singular values larger than the original
 # and normalize by the number of permutations. We can treat this value as a
@@ -213,45 +244,96 @@ for n, pval in enumerate(sprob):
 
 n_boot = 50
 
+# Bootstrap resampling can (rarely) generate a column with a standard deviation
+# of zero, which :py:func:`scipy.stats.zscore` would turn into NaNs. Instead of
+# z-scoring and then converting NaNs to zeros, we'll use a small z-scoring
+# function that directly returns zeros for those columns (dividing by infinity
+# rather than zero). It also avoids some of the intermediate arrays that
+# ``zscore`` creates, which adds up when we call it on ``X`` every bootstrap.
+
+
+def zscore_safe(data):
+    centered = data - data.mean(axis=0)
+    std = np.sqrt(np.einsum('ij,ij->j', centered, centered)
+                  / (len(data) - 1))
+    std[std == 0] = np.inf
+    centered /= std
+    return centered
+
+
 # It's too memory-intensive to hold all the bootstrapped functional connection
 # weights at once, especially if we're using a lot of bootstraps. Since we just
 # want to calculate the standard error of this distribution we can keep
-# estimates of the sum and the squared sum of the bootstrapped weights and
-# generate the standard error from those.
-U_sum = U @ np.diag(sval)
-U_square = (U @ np.diag(sval)) ** 2
+# running estimates of the mean and the sum of squared deviations from the mean
+# of the bootstrapped weights (using Welford's algorithm) and generate the
+# standard error from those. We'll include the original weights as the first
+# "sample" of the distribution.
+#
+# (You may see this done by keeping the sum and the squared sum of the weights
+# instead; that's simpler but can be numerically unstable, so we avoid it.)
+U_weights = U * sval
+U_mean = U_weights.astype(np.float32)
+U_m2 = np.zeros_like(U_mean)
+
+# The projection of the bootstrapped ``X`` matrices onto the original component
+# space (see below) uses the normalized left singular vectors, which don't
+# change between bootstraps, so we'll calculate them once here. We'll also keep
+# a single-precision copy of ``U`` for the Procrustes alignment.
+U32 = U.astype(np.float32)
+U_norm = U32 / np.linalg.norm(U32, axis=0, keepdims=True)
 
 # We CAN store all the bootstrapped PANAS score correlations in memory, and
 # need to in order to correctly estimate the confidence intervals!
 y_corr_distrib = np.zeros((*V.shape, n_boot))
 
-for n in range(n_boot):
+# Each bootstrap sample is independent of all the others, so we can generate
+# them in parallel. We'll put everything we need to do for a single bootstrap
+# sample into a function that returns the aligned functional connection weights
+# and the PANAS score correlations for that sample. Rather than allocating a
+# new (big!) cross-correlation matrix for every sample, the function writes it
+# into an ``out`` array that we'll re-use across samples.
 
-    # Bootstrap resample and z-score BOTH X and Y matrices. Also convert NaN
-    # values to 0 (in the event that resampling generates a column with
-    # a standard deviation of 0).
-    bootsamp = rs.choice(len(X), size=len(X), replace=True)
-    Xb, Yb = X[bootsamp], Y[bootsamp]
-    # Suppress invalid value in true_divide warnings (we're converting NaNs so
-    # there's no point in getting annoying warnings about it).
-    with np.errstate(invalid='ignore'):
-        Xbz = np.nan_to_num(zscore(Xb, ddof=1))
-        Ybz = np.nan_to_num(zscore(Yb, ddof=1))
+inv_dof = np.float32(1 / (len(X) - 1))
 
-    # Regenerate the cross-correlation matrix and compute the decomposition
-    cross_corr = (Ybz.T @ Xbz) / (len(Xbz) - 1)
-    U_new, sval_new, V_new = svd(cross_corr.T, full_matrices=False)
 
-    # Align the left singular vectors to the original decomposition using
-    # a Procrustes and store the sum / sum of squares for bootstrap ratio
-    # calculation later
-    N, _, P = svd(U.T @ U_new, full_matrices=False)
-    aligned = U_new @ np.diag(sval_new) @ (P.T @ N.T)
-    U_sum += aligned
-    U_square += np.square(aligned)
+def bootstrap_sample(bootsamp, out):
+    # Resample and z-score BOTH X and Y matrices
+    Xb, Yb = X32[bootsamp], Y32[bootsamp]
+    Xbz, Ybz = zscore_safe(Xb), zscore_safe(Yb)
 
-    # Delete intermediate variables to reduce memory usage
-    del cross_corr, U_new, sval_new, V_new, aligned
+    # Regenerate the cross-correlation matrix (we scale the small ``Ybz``
+    # matrix rather than the much larger product)
+    Ybz *= inv_dof
+    cross_corr = np.matmul(Ybz.T, Xbz, out=out)
+
+    # Just like in the permutation test, we can get the singular values and
+    # right singular vectors from the tiny PANAS x PANAS Gram matrix of the
+    # cross-correlation matrix: they're the square roots of its eigenvalues
+    # and its eigenvectors, respectively. :py:func:`numpy.linalg.eigh` returns
+    # these in ascending order, so we flip them around. Then we only need one
+    # more matrix multiplication to recover the left singular vectors.
+    #
+    # Forming the Gram matrix squares the condition number of the
+    # cross-correlation matrix, so we do this part in double precision (it's
+    # only a PANAS x PANAS matrix, after all). If a resampled PANAS score is
+    # constant then ``zscore_safe`` zeroes it and (at least) one singular value
+    # is zero, up to numerical noise. We can't recover a left singular vector
+    # for those, so we leave them as zeros.
+    cross_corr64 = cross_corr.astype(np.float64)
+    evals, evecs = np.linalg.eigh(cross_corr64 @ cross_corr64.T)
+    sval_new = np.sqrt(np.clip(evals[::-1], 0, None))
+    tol = sval_new[0] * len(sval_new) * np.finfo(np.float32).eps
+    U_new = np.divide(cross_corr64.T @ evecs[:, ::-1], sval_new,
+                      out=np.zeros((cross_corr.shape[1], len(sval_new)),
+                                   dtype=np.float32),
+                      where=sval_new > tol)
+    sval_new = sval_new.astype(np.float32)
+
+    # Align the left singular vectors to the original decomposition using
+    # a Procrustes rotation (i.e., the orthogonal factor of a polar
+    # decomposition; see the permutation test above)
+    rotation, _ = polar(U32.T @ U_new)
+    aligned = (U_new * sval_new) @ rotation.T
 
     # For the right singular vectors we actually want to calculate the
     # bootstrapped distribution of the CORRELATIONS between the original PANAS
@@ -259,18 +341,54 @@ for n in range(n_boot):
     #
     # We project the bootstrapped X matrix to the original component space and
     # then generate the cross-correlation matrix of the bootstrapped PANAS
-    # scores with those projections
-    Xbzs = zscore(Xb @ (U / np.linalg.norm(U, axis=0, keepdims=True)), ddof=1)
-    y_corr_distrib[..., n] = (Ybz.T @ Xbzs) / (len(Xbzs) - 1)
-
-    # Delete intermediate variables to reduce memory usage
-    del Xbz, Ybz, Xbzs
+    # scores with those projections (``Ybz`` has already been scaled!)
+    Xbzs = zscore(Xb @ U_norm, ddof=1)
+    y_corr_boot = Ybz.T @ Xbzs
+
+    return aligned, y_corr_boot
+
+
+# We generate all the bootstrap resampling indices up front (so the results
+# don't depend on the order in which samples are processed) and then use
+# :py:mod:`joblib` to run batches of bootstrap samples in parallel. Since most
+# of the work happens inside NumPy (which releases the GIL) we can use threads,
+# which avoids having to copy our (big!) data matrices to separate processes.
+# We only run ``n_jobs`` samples at a time so that we never have more than a
+# few sets of the bootstrapped functional connection weights in memory. That
+# also means we only need ``n_jobs`` cross-correlation matrices to work in:
+# every sample in a batch gets its own, so the threads never share one.
+
+from joblib import Parallel, delayed
+
+n_jobs = 4
+cross_corr_bufs = np.empty((n_jobs, Y.shape[1], X.shape[1]), dtype=np.float32)
+bootsamps = [rs.choice(len(X), size=len(X), replace=True)
+             for n in range(n_boot)]
+
+with Parallel(n_jobs=n_jobs, prefer='threads') as parallel:
+    for start in range(0, n_boot, n_jobs):
+        batch = range(start, min(start + n_jobs, n_boot))
+        results = parallel(delayed(bootstrap_sample)(bootsamps[n], buf)
+                           for n, buf in zip(batch, cross_corr_bufs))
+
+        for n, (aligned, y_corr_boot) in zip(batch, results):
+            # Update the running mean / sum of squared deviations for
+            # bootstrap ratio calculation later (this is the ``n + 2``-th
+            # sample, counting the original weights)
+            delta = aligned - U_mean
+            U_mean += delta / (n + 2)
+            U_m2 += delta * (aligned - U_mean)
+
+            # Store the bootstrapped PANAS score correlations
+            y_corr_distrib[..., n] = y_corr_boot
+
+        # Delete intermediate variables to reduce memory usage
+        del results, aligned, delta
 
 # Calculate the standard error of the bootstrapped functional connection
 # weights and generate bootstrap ratios from these values.
-U_sum2 = (U_sum ** 2) / (n_boot + 1)
-U_se = np.sqrt(np.abs(U_square - U_sum2) / (n_boot))
-bootstrap_ratios = (U @ np.diag(sval)) / U_se
+U_se = np.sqrt(U_m2 / n_boot)
+bootstrap_ratios = U_weights / U_se
 
 # Calculate the lower/upper confidence intervals of the bootrapped PANAS scores
 y_corr_ll, y_corr_ul = np.percentile(y_corr_distrib, [2.5, 97.5], axis=-1)
@@ -281,15 +399,16 @@ y_corr_ll, y_corr_ul = np.percentile(y_corr_distrib, [2.5, 97.5], axis=-1)
 
 # Community assignments for the MyConnectome dataset are stored online. We'll
 # fetch and load those into an array so we can plot the bootstrap ratios sorted
-# by communities.
+# by communities. The file has a number of columns but we only need the ninth
+# one, so we'll only load that.
 
 from urllib.request import urlopen
 
 comm_url = "http://web.stanford.edu/group/poldracklab/myconnectome-data/base" \
            "/parcellation/parcel_data.txt"
-comm = np.loadtxt(urlopen(comm_url).readlines(), delimiter='\t', dtype=str)
+comm = np.loadtxt(urlopen(comm_url), delimiter='\t', usecols=8, dtype=str)
 
-# The ninth column of this array specifies the Yeo 7-network affiliation of the
+# The ninth column of the file specifies the Yeo 7-network affiliation of the
 # nodes with e.g., "7Network_1," "7Network_2." We'd prefer to just have a
 # numerical vector specifying network assignments, so we convert it here. We'll
 # also list the actual Yeo networks, as well, so that we can plot them.
@@ -299,7 +418,7 @@ comm_labels = [
     'visual', 'somatomotor', 'dorsal attention', 'ventral attention',
     'limbic', 'frontoparietal', 'default', '', ''
 ]
-comm_ids = np.unique(comm[:, 8], return_inverse=True)[-1]
+comm_ids = np.unique(comm, return_inverse=True)[-1]
 
 # Now we can actually plot things! First, make a little grid of plots to
 # approximately match the layout from Figure 1.
@@ -318,9 +437,11 @@ ax3 = plt.subplot(gs[1, :])
 
 from netneurotools.plotting import plot_mod_heatmap
 
+# The bootstrap ratios are the lower triangle of the connectivity matrix
+# (row by row), so we put them there and in the mirrored upper triangle
 bsr_mat = np.zeros((630, 630))
-bsr_mat[np.tril_indices_from(bsr_mat, k=-1)] = bootstrap_ratios[:, 0]
-bsr_mat = bsr_mat + bsr_mat.T
+rows, cols = np.tril_indices(len(bsr_mat), k=-1)
+bsr_mat[rows, cols] = bsr_mat[cols, rows] = bootstrap_ratios[:, 0]
 
 plot_mod_heatmap(bsr_mat, comm_ids, vmin=-4, vmax=4, ax=ax1,
                  cmap='RdBu_r', cbar=False, edgecolor='red',
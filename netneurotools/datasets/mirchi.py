@@ -7,6 +7,7 @@ import os
 from urllib.request import HTTPError, urlopen
 
 import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
 
 from .utils import _get_data_dir
 
@@ -113,8 +114,6 @@ def _get_panas(data_dir=None, resume=True, verbose=1):
         composite measures
     """
 
-    from numpy.lib.recfunctions import structured_to_unstructured as stu
-
     # download behavioral data
     out = urlopen(BEHAVIOR)
     if out.status == 200:
@@ -132,13 +131,15 @@ def _get_panas(data_dir=None, resume=True, verbose=1):
     # create subscales from individual item scores
     measures = {}
     for subscale, items in PANAS.items():
-        measure = stu(panas[['panas{}'.format(f) for f in items]])
+        items = ['panas{}'.format(f) for f in items]
+        measure = structured_to_unstructured(panas[items])
         measures[subscale] = measure.sum(axis=-1)
 
     return measures
 
 
-def fetch_mirchi2018(data_dir=None, resume=True, verbose=1):
+def fetch_mirchi2018(data_dir=None, resume=True, verbose=1,
+                     return_structured=True):
     """
     Downloads (and creates) dataset for replicating Mirchi et al., 2018, SCAN
 
@@ -149,6 +150,10 @@ def fetch_mirchi2018(data_dir=None, resume=True, verbose=1):
         generated data files. Files should be named mirchi2018_fc.npy and
         mirchi2018_panas.csv for the functional connectivity and behavioral
         data, respectively.
+    return_structured : bool, optional
+        Whether to return `Y` as a structured array. If False, `Y` is returned
+        as a standard (C-contiguous) float array and the names of the PANAS
+        subscales are returned separately. Default: True
 
     Returns
     -------
@@ -156,6 +161,9 @@ def fetch_mirchi2018(data_dir=None, resume=True, verbose=1):
         Functional connections from MyConnectome rsfMRI time series data
     Y : (73, 13) numpy.ndarray
         PANAS subscales from MyConnectome behavioral data
+    names : list of str
+        Names of PANAS subscales in `Y`. Only returned if `return_structured`
+        is False
     """
 
     data_dir = os.path.join(_get_data_dir(data_dir=data_dir), 'ds-mirchi2018')
@@ -180,4 +188,9 @@ def fetch_mirchi2018(data_dir=None, resume=True, verbose=1):
     else:
         Y = np.genfromtxt(Y_fname, delimiter=',', names=True, dtype=int)
 
+    if not return_structured:
+        names = list(Y.dtype.names)
+        Y = np.ascontiguousarray(structured_to_unstructured(Y, dtype=float))
+        return X, Y, names
+
     return X, Y
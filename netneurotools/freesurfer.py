@@ -5,6 +5,7 @@ Functions for working with FreeSurfer data and parcellations
 
 import os
 import os.path as op
+import shlex
 
 from nibabel.freesurfer import read_annot, read_geometry
 import numpy as np
@@ -90,8 +91,8 @@ def apply_prob_atlas(subject_id, gcs, hemi, *, orig='white', annot=None,
 
     # if annotation file doesn't exist or we explicitly want to make a new one
     if not op.isfile(annot) or not use_cache:
-        run(cmd.format(opts=opts, subject_id=subject_id, hemi=hemi,
-                       gcs=gcs, annot=annot),
+        run(shlex.split(cmd.format(opts=opts, subject_id=subject_id,
+                                   hemi=hemi, gcs=gcs, annot=annot)),
             quiet=quiet)
 
     return annot
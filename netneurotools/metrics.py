@@ -89,10 +89,10 @@ def communicability_wei(adjacency):
     # negative square root of nodal degrees
     row_sum = adjacency.sum(1)
     neg_sqrt = np.power(row_sum, -0.5)
-    square_sqrt = np.diag(neg_sqrt)
 
-    # normalize input matrix
-    for_expm = square_sqrt @ adjacency @ square_sqrt
+    # normalize input matrix (scaling rows / columns is equivalent to pre- and
+    # post-multiplying by a diagonal matrix of `neg_sqrt`, but much cheaper)
+    for_expm = neg_sqrt[:, None] * adjacency * neg_sqrt
 
     # calculate matrix exponential of normalized matrix
     cmc = expm(for_expm)
@@ -6,12 +6,32 @@ Functions for performing statistical preprocessing and analyses
 import warnings
 
 import numpy as np
-from scipy import optimize, spatial, special, stats as sstats
+import scipy
+from scipy import linalg, optimize, sparse, spatial, special, stats as sstats
 from scipy.stats.stats import _chk2_asarray
 from sklearn.utils.validation import check_random_state
 
 from . import utils
 
+try:
+    from numba import njit, prange
+    use_numba = True
+except ImportError:
+    prange = range
+    use_numba = False
+
+# cKDTree.query's `n_jobs` argument was renamed `workers` in scipy 1.6
+if tuple(int(v) for v in scipy.__version__.split('.')[:2]) >= (1, 6):
+    _query_jobs = dict(workers=-1)
+else:
+    _query_jobs = dict(n_jobs=-1)
+
+# sparse bipartite matching (for exact spins of large N) needs scipy >= 1.6
+try:
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+except ImportError:
+    min_weight_full_bipartite_matching = None
+
 
 def residualize(X, Y, Xc=None, Yc=None, normalize=True, add_intercept=True):
     """
@@ -53,24 +73,55 @@ def residualize(X, Y, Xc=None, Yc=None, normalize=True, add_intercept=True):
 
     X, Y = np.asarray(X), np.asarray(Y)
 
-    if Yc is None:
-        Xc, Yc = X.copy(), Y.copy()
+    # without a comparative group the fit and the residuals come from the same
+    # data, so there's no need to copy it or calculate the residuals twice
+    same = Yc is None
+    if same:
+        Xc, Yc = X, Y
     else:
         Xc, Yc = np.asarray(Xc), np.asarray(Yc)
 
     # add intercept to regressors if requested and calculate fit
     if add_intercept:
-        X, Xc = utils.add_constant(X), utils.add_constant(Xc)
-    betas, *rest = np.linalg.lstsq(Xc, Yc, rcond=None)
+        X = utils.add_constant(X)
+        Xc = X if same else utils.add_constant(Xc)
+    # with only a few regressors solving the normal equations via Cholesky is
+    # fastest, but it squares the condition number of the regressors so we
+    # only do it when that's harmless
+    betas = None
+    if Xc.ndim == 2 and Xc.shape[1] <= 32 and len(Xc) > 4 * Xc.shape[1]:
+        XtX = Xc.T @ Xc
+        try:
+            evals = np.linalg.eigvalsh(XtX)
+            if evals[0] > evals[-1] * np.sqrt(np.finfo(float).eps):
+                betas = linalg.cho_solve(
+                    linalg.cho_factor(XtX, check_finite=False), Xc.T @ Yc,
+                    check_finite=False
+                )
+        except np.linalg.LinAlgError:
+            pass
+
+    # otherwise, QR-based gelsy is much quicker than the default (SVD-based)
+    # gelsd and still copes with rank-deficient regressors (we use the same
+    # cutoff for determining rank as :py:func:`numpy.linalg.lstsq`)
+    if betas is None:
+        cond = np.finfo(float).eps * max(Xc.shape)
+        betas, *rest = linalg.lstsq(Xc, Yc, cond=cond, lapack_driver='gelsy')
 
     # remove intercept from regressors and betas for calculation of residuals
     if add_intercept:
         betas = betas[:-1]
         X, Xc = X[:, :-1], Xc[:, :-1]
 
-    # calculate residuals
-    Yr = Y - (X @ betas)
-    Ycr = Yc - (Xc @ betas)
+    # calculate residuals, subtracting in place from the fitted values to
+    # avoid allocating a second (N, F) array
+    Yr = X @ betas
+    Yr = np.subtract(Y, Yr, out=Yr)
+    if same:
+        Ycr = Yr
+    else:
+        Ycr = Xc @ betas
+        Ycr = np.subtract(Yc, Ycr, out=Ycr)
 
     if normalize:
         Yr = sstats.zmap(Yr, compare=Ycr)
@@ -131,21 +182,30 @@ def get_mad_outliers(data, thresh=3.5):
     data = np.asarray(data)
 
     if data.ndim == 1:
-        data = np.vstack(data)
+        data = data.reshape(-1, 1)
     if data.ndim > 2:
         data = data.reshape(len(data), -1)
 
-    median = np.nanmedian(data, axis=0)
-    diff = np.nansum((data - median)**2, axis=-1)
-    diff = np.sqrt(diff)
+    # compute squared deviations from the median in a single scratch array.
+    # np.median selects (rather than sorts) along the whole axis at once, but
+    # np.nanmedian works column-by-column so only use it if we have to
+    if np.isnan(data).any():
+        median = np.nanmedian(data, axis=0)
+    else:
+        median = np.median(data, axis=0)
+    diff = np.subtract(data, median, out=np.empty(data.shape))
+    np.square(diff, out=diff)
+    # nansum never returns NaN so we can skip the NaN check here
+    diff = np.sqrt(np.nansum(diff, axis=-1))
     med_abs_deviation = np.median(diff)
 
-    modified_z_score = 0.6745 * diff / med_abs_deviation
+    modified_z_score = diff * (0.6745 / med_abs_deviation)
 
     return modified_z_score > thresh
 
 
-def permtest_1samp(a, popmean, axis=0, n_perm=1000, seed=0):
+def permtest_1samp(a, popmean, axis=0, n_perm=1000, seed=0,
+                   early_stop_thresh=None, dtype=np.float64):
     """
     Non-parametric equivalent of :py:func:`scipy.stats.ttest_1samp`
 
@@ -169,6 +229,14 @@ def permtest_1samp(a, popmean, axis=0, n_perm=1000, seed=0):
     seed : {int, np.random.RandomState instance, None}, optional
         Seed for random number generation. Set to None for "randomness".
         Default: 0
+    early_stop_thresh : float, optional
+        If specified, stop permuting a test once it is guaranteed to have a
+        p-value greater than this threshold; its p-value is then estimated
+        from the permutations performed up to that point. Default: None
+    dtype : data-type, optional
+        Floating point type used for the permuted statistics. Using
+        `np.float32` roughly halves the memory (and time) needed for the
+        permutations but may change p-values slightly. Default: `np.float64`
 
     Returns
     -------
@@ -185,6 +253,10 @@ def permtest_1samp(a, popmean, axis=0, n_perm=1000, seed=0):
     The lowest p-value that can be returned by this function is equal to 1 /
     (`n_perm` + 1).
 
+    Setting `early_stop_thresh` can save a lot of time when most tests are
+    non-significant. Permutations are still drawn as though no tests stopped
+    early, so the p-values of tests that don't stop are unaffected.
+
     Examples
     --------
     >>> from netneurotools import stats
@@ -196,16 +268,16 @@ def permtest_1samp(a, popmean, axis=0, n_perm=1000, seed=0):
     first case.
 
     >>> stats.permtest_1samp(rvs, 5.0)
-    (array([-0.985602  , -0.05204969]), array([0.48551449, 0.95904096]))
+    (array([-0.985602  , -0.05204969]), array([0.48951049, 0.96603397]))
     >>> stats.permtest_1samp(rvs, 0.0)
-    (array([4.014398  , 4.94795031]), array([0.00699301, 0.000999  ]))
+    (array([4.014398  , 4.94795031]), array([0.00999001, 0.000999  ]))
 
     Example using axis and non-scalar dimension for population mean
 
     >>> stats.permtest_1samp(rvs, [5.0, 0.0])
-    (array([-0.985602  ,  4.94795031]), array([0.48551449, 0.000999  ]))
+    (array([-0.985602  ,  4.94795031]), array([0.48951049, 0.000999  ]))
     >>> stats.permtest_1samp(rvs.T, [5.0, 0.0], axis=1)
-    (array([-0.985602  ,  4.94795031]), array([0.51548452, 0.000999  ]))
+    (array([-0.985602  ,  4.94795031]), array([0.48951049, 0.000999  ]))
     """
 
     a, popmean, axis = _chk2_asarray(a, popmean, axis)
@@ -221,21 +293,50 @@ def permtest_1samp(a, popmean, axis=0, n_perm=1000, seed=0):
     # center `a` around `popmean` and calculate original mean
     zeroed = a - popmean
     true_mean = zeroed.mean(axis=axis) / 1
-    abs_mean = np.abs(true_mean)
-
-    # this for loop is not _the fastest_ but is memory efficient
-    # the broadcasting alt. would mean storing zeroed.size * n_perm in memory
-    permutations = np.ones(true_mean.shape)
-    for perm in range(n_perm):
-        flipped = zeroed * rs.choice([-1, 1], size=zeroed.shape)  # sign flip
-        permutations += np.abs(flipped.mean(axis=axis)) >= abs_mean
-
-    pvals = permutations / (n_perm + 1)  # + 1 in denom accounts for true_mean
+    abs_mean = np.ravel(np.abs(true_mean))
+
+    # sign flip blocks of permutations at once; doing all permutations at once
+    # would mean storing zeroed.size * n_perm in memory, so we cap the size of
+    # each block
+    zeroed = np.moveaxis(zeroed, axis, 0).reshape(zeroed.shape[axis], -1)
+    total = zeroed.sum(axis=0)
+    zeroed = zeroed.astype(dtype, copy=False)
+    permutations, n_done = np.ones(abs_mean.size), np.zeros(abs_mean.size)
+    active = np.ones(abs_mean.size, dtype=bool)
+    block = max(1, min(n_perm, 128, 2 ** 20 // max(zeroed.size, 1)))
+    n_bytes = 4 * -(-zeroed.size // 32)
+    for start in range(0, n_perm, block):
+        size = (min(block, n_perm - start),) + zeroed.shape
+        # flipping the sign of some values reduces the sum by twice their sum,
+        # so we only need to know which values to flip. we use each bit of a
+        # random byte string for one flip, which is much faster than drawing
+        # the flips one at a time. every permutation gets a whole number of
+        # 32-bit words (the unit in which random bytes are generated) so that
+        # the random stream doesn't depend on the size of the blocks
+        flip = np.frombuffer(rs.bytes(size[0] * n_bytes), dtype=np.uint8)
+        flip = np.unpackbits(flip.reshape(size[0], n_bytes), axis=1)
+        flip = flip[:, :zeroed.size].reshape(size)
+        cols = slice(None) if active.all() else active
+        flipped = total[cols] - 2 * np.einsum('pnk,nk->pk',
+                                              flip[..., cols].astype(dtype),
+                                              zeroed[:, cols])
+        permutations[cols] += np.sum(np.abs(flipped / len(zeroed))
+                                     >= abs_mean[cols], axis=0)
+        n_done[cols] += size[0]
+        if early_stop_thresh is not None:
+            active &= permutations <= early_stop_thresh * (n_perm + 1)
+            if not active.any():
+                break
+
+    # + 1 in denom accounts for true_mean
+    pvals = (permutations.reshape(np.shape(true_mean))
+             / (n_done.reshape(np.shape(true_mean)) + 1))
 
     return true_mean, pvals
 
 
-def permtest_rel(a, b, axis=0, n_perm=1000, seed=0):
+def permtest_rel(a, b, axis=0, n_perm=1000, seed=0,
+                 early_stop_thresh=None, dtype=np.float64):
     """
     Non-parametric equivalent of :py:func:`scipy.stats.ttest_rel`
 
@@ -256,6 +357,15 @@ def permtest_rel(a, b, axis=0, n_perm=1000, seed=0):
     seed : {int, np.random.RandomState instance, None}, optional
         Seed for random number generation. Set to None for "randomness".
         Default: 0
+    early_stop_thresh : float, optional
+        If specified, stop permuting a test once it is guaranteed to have a
+        p-value greater than this threshold; its p-value is then estimated
+        from the permutations performed up to that point. Default: None
+    dtype : data-type, optional
+        Floating point type used for the permuted statistics. Using
+        `np.float32` roughly halves the memory needed for the permutations
+        (but won't make them faster, since drawing the random swaps dominates
+        their cost) and may change p-values slightly. Default: `np.float64`
 
     Returns
     -------
@@ -269,6 +379,15 @@ def permtest_rel(a, b, axis=0, n_perm=1000, seed=0):
     The lowest p-value that can be returned by this function is equal to 1 /
     (`n_perm` + 1).
 
+    Setting `early_stop_thresh` can save a lot of time when most tests are
+    non-significant. Permutations are still drawn as though no tests stopped
+    early, so the p-values of tests that don't stop are unaffected.
+
+    The same random swaps of `a` and `b` are used for every test. For inputs
+    with more than two dimensions this differs from earlier versions of this
+    function (which drew separate swaps for each of the trailing dimensions),
+    so p-values obtained with a fixed `seed` will not match those versions.
+
     Examples
     --------
     >>> from netneurotools import stats
@@ -296,30 +415,42 @@ def permtest_rel(a, b, axis=0, n_perm=1000, seed=0):
         return np.nan, np.nan
 
     # calculate original difference in means
-    ab = np.stack([a, b], axis=0)
-    if ab.ndim < 3:
-        ab = np.expand_dims(ab, axis=-1)
-    true_diff = np.squeeze(np.diff(ab, axis=0)).mean(axis=axis) / 1
+    diff = np.moveaxis(b - a, axis, 0)
+    tests_shape = diff.shape[1:]
+    diff = diff.reshape(len(diff), -1)
+    true_diff = diff.mean(axis=0)
     abs_true = np.abs(true_diff)
-
-    # idx array
-    reidx = np.meshgrid(*[range(f) for f in ab.shape], indexing='ij')
-
-    permutations = np.ones(true_diff.shape)
-    for perm in range(n_perm):
-        # use this to re-index (i.e., swap along) the first axis of `ab`
-        swap = rs.random_sample(ab.shape[:-1]).argsort(axis=axis)
-        reidx[0] = np.repeat(swap[..., np.newaxis], ab.shape[-1], axis=-1)
-        # recompute difference between `a` and `b` (i.e., first axis of `ab`)
-        pdiff = np.squeeze(np.diff(ab[tuple(reidx)], axis=0)).mean(axis=axis)
-        permutations += np.abs(pdiff) >= abs_true
-
-    pvals = permutations / (n_perm + 1)  # + 1 in denom accounts for true_diff
+    diff = diff.astype(dtype, copy=False)
+
+    # randomly swap `a` and `b` (i.e., flip the sign of their difference) for
+    # each observation, using the same swaps for every test. we draw swaps for
+    # blocks of permutations at once and apply them with a single matmul
+    permutations, n_done = np.ones(true_diff.size), np.zeros(true_diff.size)
+    active = np.ones(true_diff.size, dtype=bool)
+    block = max(1, min(n_perm, 128, 2 ** 20 // max(diff.size, 1)))
+    for start in range(0, n_perm, block):
+        rand = rs.random_sample((min(block, n_perm - start), 2, len(diff)))
+        signs = np.where(rand[:, 0] > rand[:, 1], -1.0, 1.0)
+        signs = signs.astype(dtype, copy=False)
+        cols = slice(None) if active.all() else active
+        pdiff = (signs @ diff[:, cols]) / len(diff)
+        permutations[cols] += np.sum(np.abs(pdiff) >= abs_true[cols], axis=0)
+        n_done[cols] += len(signs)
+        if early_stop_thresh is not None:
+            active &= permutations <= early_stop_thresh * (n_perm + 1)
+            if not active.any():
+                break
+
+    true_diff = np.squeeze(true_diff.reshape(tests_shape)) / 1
+    permutations = np.squeeze(permutations.reshape(tests_shape))
+    n_done = np.squeeze(n_done.reshape(tests_shape))
+    pvals = permutations / (n_done + 1)  # + 1 in denom accounts for true_diff
 
     return true_diff, pvals
 
 
-def permtest_pearsonr(a, b, axis=0, n_perm=1000, resamples=None, seed=0):
+def permtest_pearsonr(a, b, axis=0, n_perm=1000, resamples=None, seed=0,
+                      early_stop_thresh=None, dtype=np.float64):
     """
     Non-parametric equivalent of :py:func:`scipy.stats.pearsonr`
 
@@ -347,6 +478,14 @@ def permtest_pearsonr(a, b, axis=0, n_perm=1000, resamples=None, seed=0):
     seed : {int, np.random.RandomState instance, None}, optional
         Seed for random number generation. Set to None for "randomness".
         Default: 0
+    early_stop_thresh : float, optional
+        If specified, stop permuting a test once it is guaranteed to have a
+        p-value greater than this threshold; its p-value is then estimated
+        from the permutations performed up to that point. Default: None
+    dtype : data-type, optional
+        Floating point type used for the permuted statistics. Using
+        `np.float32` roughly halves the memory (and time) needed for the
+        permutations but may change p-values slightly. Default: `np.float64`
 
     Returns
     -------
@@ -360,6 +499,10 @@ def permtest_pearsonr(a, b, axis=0, n_perm=1000, resamples=None, seed=0):
     The lowest p-value that can be returned by this function is equal to 1 /
     (`n_perm` + 1).
 
+    Setting `early_stop_thresh` can save a lot of time when most tests are
+    non-significant. Permutations are still drawn as though no tests stopped
+    early, so the p-values of tests that don't stop are unaffected.
+
     Examples
     --------
     >>> from netneurotools import datasets, stats
@@ -406,16 +549,47 @@ def permtest_pearsonr(a, b, axis=0, n_perm=1000, resamples=None, seed=0):
     true_corr = efficient_pearsonr(a, b)[0] / 1
     abs_true = np.abs(true_corr)
 
-    permutations = np.ones(true_corr.shape)
-    for perm in range(n_perm):
-        # permute `a` and determine whether correlations exceed original
+    # z-score both arrays once and correlate blocks of permutations at a time
+    # (blocks cap the memory needed to store the permuted z-scores). we don't
+    # broadcast single-column arrays: einsum does that for us
+    a, b = a.reshape(len(a), -1), b.reshape(len(b), -1)
+    with np.errstate(invalid='ignore'):
+        za, zb = sstats.zscore(a, ddof=1), sstats.zscore(b, ddof=1)
+    a, za, zb = [arr.astype(dtype, copy=False) for arr in (a, za, zb)]
+    abs_true = np.ravel(abs_true)
+    n_tests = max(a.shape[1], b.shape[1])
+
+    permutations, n_done = np.ones(n_tests), np.zeros(n_tests)
+    active = np.ones(n_tests, dtype=bool)
+    block = max(1, min(n_perm, 128, 2 ** 20 // (len(a) * n_tests)))
+    for start in range(0, n_perm, block):
+        stop = min(start + block, n_perm)
+        cols = slice(None) if active.all() else active
+        ac, zac, zbc = [arr if arr.shape[1] == 1 else arr[:, cols]
+                        for arr in (a, za, zb)]
+        # permute `a` and determine whether correlations exceed original.
+        # permuting only reorders the rows of the z-scores, but resampling
+        # arrays may repeat rows so those need to be z-scored again
         if resamples is None:
-            ap = a[rs.permutation(len(a))]
+            perms = np.vstack([rs.permutation(len(a))
+                               for perm in range(start, stop)])
+            zap = zac[perms]
         else:
-            ap = a[resamples[:, perm]]
-        permutations += np.abs(efficient_pearsonr(ap, b)[0]) >= abs_true
-
-    pvals = permutations / (n_perm + 1)  # + 1 in denom accounts for true_corr
+            perms = resamples[:, start:stop].T
+            with np.errstate(invalid='ignore'):
+                zap = sstats.zscore(ac[perms], axis=1, ddof=1)
+        corr = np.einsum('pni,ni->pi', zap, zbc) / (len(a) - 1)
+        corr = np.clip(corr, -1, 1)
+        permutations[cols] += np.sum(np.abs(corr) >= abs_true[cols], axis=0)
+        n_done[cols] += stop - start
+        if early_stop_thresh is not None:
+            active &= permutations <= early_stop_thresh * (n_perm + 1)
+            if not active.any():
+                break
+
+    # + 1 in denom accounts for true_corr
+    pvals = (permutations.reshape(np.shape(true_corr))
+             / (n_done.reshape(np.shape(true_corr)) + 1))
 
     return true_corr, pvals
 
@@ -463,12 +637,17 @@ def efficient_pearsonr(a, b):
         return np.nan, np.nan
 
     a, b = a.reshape(len(a), -1), b.reshape(len(b), -1)
+    a, b = a - a.mean(axis=0), b - b.mean(axis=0)
     if (a.shape[1] != b.shape[1]):
-        a, b = np.broadcast_arrays(a, b)
+        shape = np.broadcast(a, b).shape
+        a, b = np.broadcast_to(a, shape), np.broadcast_to(b, shape)
 
+    # reduce the centered arrays directly rather than z-scoring them first;
+    # einsum avoids materializing any (N, M) products
+    num = np.einsum('ij,ij->j', a, b)
+    den = np.sqrt(np.einsum('ij,ij->j', a, a) * np.einsum('ij,ij->j', b, b))
     with np.errstate(invalid='ignore'):
-        corr = sstats.zscore(a, ddof=1) * sstats.zscore(b, ddof=1)
-    corr = np.sum(corr, axis=0) / (len(a) - 1)
+        corr = num / den
     corr = np.squeeze(np.clip(corr, -1, 1)) / 1
 
     # taken from scipy.stats
@@ -493,23 +672,150 @@ def _gen_rotation(seed=None):
         Rotations for left and right hemisphere coordinates, respectively
     """
 
+    rotate_l, rotate_r = _gen_rotations_batch(1, seed=seed)
+
+    return rotate_l[0], rotate_r[0]
+
+
+def _gen_rotations_batch(n_rotate, seed=None):
+    """
+    Generates random matrices for rotating spherical coordinates
+
+    Rotations are drawn from the random state in the same order as they would
+    be by `n_rotate` successive calls to :py:func:`_gen_rotation`
+
+    Parameters
+    ----------
+    n_rotate : int
+        Number of rotations to generate
+    seed : {int, np.random.RandomState instance, None}, optional
+        Seed for random number generation
+
+    Returns
+    -------
+    rotate_{l,r} : (`n_rotate`, 3, 3) numpy.ndarray
+        Rotations for left and right hemisphere coordinates, respectively
+    """
+
     rs = check_random_state(seed)
 
     # for reflecting across Y-Z plane
     reflect = np.array([[-1, 0, 0], [0, 1, 0], [0, 0, 1]])
 
-    # generate rotation for left
-    rotate_l, temp = np.linalg.qr(rs.normal(size=(3, 3)))
-    rotate_l = rotate_l @ np.diag(np.sign(np.diag(temp)))
-    if np.linalg.det(rotate_l) < 0:
-        rotate_l[:, 0] = -rotate_l[:, 0]
-
-    # reflect the left rotation across Y-Z plane
+    # generate rotations for left as the Q factors (with positive diagonal R)
+    # of random matrices; np.linalg.qr won't take a stack of matrices before
+    # numpy 1.22 so we orthonormalize their columns with Gram-Schmidt instead
+    rotate_l = rs.normal(size=(n_rotate, 3, 3))
+    for col in range(3):
+        vec = rotate_l[..., col]
+        for prev in range(col):
+            vec -= np.sum(rotate_l[..., prev] * vec, axis=-1, keepdims=True) \
+                * rotate_l[..., prev]
+        vec /= np.linalg.norm(vec, axis=-1, keepdims=True)
+    rotate_l[np.linalg.det(rotate_l) < 0, :, 0] *= -1
+
+    # reflect the left rotations across Y-Z plane
     rotate_r = reflect @ rotate_l @ reflect
 
     return rotate_l, rotate_r
 
 
+def _nearest_neighbors(coords, targets):
+    """
+    Finds nearest neighbor in `targets` for every point in `coords`
+
+    Brute-force alternative to querying a :py:class:`scipy.spatial.cKDTree`
+    that avoids building a new tree for every set of `targets`
+
+    Parameters
+    ----------
+    coords : (N, 3) array_like
+        Coordinates of query points
+    targets : (M, 3) array_like
+        Coordinates of candidate neighbors
+
+    Returns
+    -------
+    dist : (N,) numpy.ndarray
+        Euclidean distance from each point in `coords` to its nearest neighbor
+    idx : (N,) numpy.ndarray
+        Index of the nearest neighbor in `targets` for each point in `coords`
+    """
+
+    # store each dimension of `targets` contiguously so the inner loop streams
+    # through memory (and can be vectorized by the compiler)
+    tx = np.ascontiguousarray(targets[:, 0])
+    ty = np.ascontiguousarray(targets[:, 1])
+    tz = np.ascontiguousarray(targets[:, 2])
+
+    dist = np.zeros(len(coords))
+    idx = np.zeros(len(coords), dtype=np.int64)
+
+    for i in prange(len(coords)):
+        cx, cy, cz = coords[i, 0], coords[i, 1], coords[i, 2]
+        best, arg = np.inf, 0
+        for j in range(len(tx)):
+            d = (cx - tx[j]) ** 2 + (cy - ty[j]) ** 2 + (cz - tz[j]) ** 2
+            if d < best:
+                best, arg = d, j
+        dist[i], idx[i] = np.sqrt(best), arg
+
+    return dist, idx
+
+
+def _exact_assignment(coords, rotated, max_dense=10000, k=50):
+    """
+    Uniquely assigns each point in `coords` to a point in `rotated`
+
+    Parameters
+    ----------
+    coords : (N, 3) array_like
+        Original coordinates
+    rotated : (N, 3) array_like
+        Rotated coordinates
+    max_dense : int, optional
+        Largest `N` for which the full distance matrix is used. Default: 10000
+    k : int, optional
+        Initial number of nearest neighbors to consider as candidate
+        assignments for each point when `N` > `max_dense`. Default: 50
+
+    Returns
+    -------
+    col : (N,) numpy.ndarray
+        Index of the point in `rotated` assigned to each point in `coords`
+    cost : float
+        Summed distance between assigned points
+    """
+
+    n_coords = len(coords)
+
+    # for large N the full distance matrix won't fit in memory, so only allow
+    # assignments to the `k` nearest neighbors of every point (and consider
+    # more neighbors if no full matching can be made from those). the cost of
+    # this assignment can be (slightly) higher than the optimal one
+    if n_coords > max_dense and min_weight_full_bipartite_matching is not None:
+        tree = spatial.cKDTree(rotated)
+        while k < n_coords:
+            dist, col = tree.query(coords, k, **_query_jobs)
+            # zero weights are treated as missing edges, so we add one to all
+            # the distances (every full matching has `N` edges, so this
+            # doesn't change which matching is best)
+            graph = sparse.csr_matrix((dist.ravel() + 1, col.ravel(),
+                                       np.arange(0, dist.size + 1, k)),
+                                      shape=(n_coords, n_coords))
+            try:
+                row, col = min_weight_full_bipartite_matching(graph)
+            except ValueError:
+                k *= 2
+                continue
+            return col, graph[row, col].sum() - n_coords
+
+    dist = spatial.distance_matrix(coords, rotated)
+    row, col = optimize.linear_sum_assignment(dist)
+
+    return col, dist[row, col].sum()
+
+
 def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
                     exact=False, seed=None):
     """
@@ -546,7 +852,9 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
     exact : bool, optional
         Whether each node/parcel/region should be uniquely re-assigned in every
         rotation. Setting to True will drastically increase the memory demands
-        and runtime of this function! Default: False
+        and runtime of this function! With scipy >= 1.6, the assignment for
+        hemispheres with more than 10000 nodes is approximate (see Notes).
+        Default: False
     seed : {int, np.random.RandomState instance, None}, optional
         Seed for random number generation. Default: None
 
@@ -590,6 +898,12 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
     of the function. Refer to [ST1]_ for information on why the default (i.e.,
     ``exact`` set to False) suffices in most cases.
 
+    To limit memory demands, exact spins of hemispheres with more than 10000
+    nodes (with scipy >= 1.6) only consider re-assigning each node to one of
+    its nearest rotated neighbors. The resampling arrays are still perfect
+    permutations, but the total re-assignment distance (i.e., the returned
+    `cost`) may be slightly higher than that of the optimal assignment.
+
     For the original MATLAB implementation of this function refer to [ST4]_.
 
     References
@@ -645,6 +959,20 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
     inds_l, inds_r = hemiid == 0, hemiid == 1
     coords_l, coords_r = coords[inds_l], coords[inds_r]
 
+    # with numba, a brute-force search for nearest neighbors is faster than
+    # building a new KD-tree for every rotation (at least for parcellations;
+    # the KD-tree scales much better with the number of coordinates)
+    use_kdtree = not use_numba or len(coords) > 700
+
+    # keep track of the resampling arrays we've already generated (and the
+    # identity, which we also want to avoid) for checking duplicates
+    seen = {inds.astype('int32').tobytes()}
+
+    # generate rotations in batches (avoiding duplicates may use up a batch,
+    # in which case we just make another)
+    rotations_l, rotations_r = _gen_rotations_batch(n_rotate, seed=seed)
+    rot = 0
+
     # generate rotations and resampling array!
     warned = False
     for n in range(n_rotate):
@@ -654,8 +982,13 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
             count, duplicated = count + 1, False
             resampled = np.zeros(len(coords), dtype='int32')
 
-            # generate left + right hemisphere rotations
-            left, right = _gen_rotation(seed=seed)
+            # grab left + right hemisphere rotations
+            if rot == len(rotations_l):
+                rotations_l, rotations_r = _gen_rotations_batch(n_rotate,
+                                                                seed=seed)
+                rot = 0
+            left, right = rotations_l[rot], rotations_r[rot]
+            rot += 1
 
             # find mapping of rotated coords to original coords
             if exact:
@@ -665,32 +998,40 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
                 #
                 # this requires calculating the FULL distance matrix, which is
                 # a nightmare with respect to memory (and frequently fails due
-                # to insufficient memory)
-                dist_l = spatial.distance_matrix(coords_l, coords_l @ left)
-                dist_r = spatial.distance_matrix(coords_r, coords_r @ right)
-                lrow, lcol = optimize.linear_sum_assignment(dist_l)
-                rrow, rcol = optimize.linear_sum_assignment(dist_r)
-                ccost = dist_l[lrow, lcol].sum() + dist_r[rrow, rcol].sum()
+                # to insufficient memory), so for large hemispheres we only
+                # consider assignments to nearby nodes (see _exact_assignment)
+                lcol, lcost = _exact_assignment(coords_l, coords_l @ left)
+                rcol, rcost = _exact_assignment(coords_r, coords_r @ right)
+                ccost = lcost + rcost
             else:
                 # if nodes can be assigned multiple targets, we can simply use
                 # the absolute minimum of the distances (no optimization
                 # required) which is _much_ lighter on memory
                 # huge thanks to: https://stackoverflow.com/a/47779290
-                dist_l, lcol = spatial.cKDTree(coords_l @ left) \
-                                      .query(coords_l, 1)
-                dist_r, rcol = spatial.cKDTree(coords_r @ right) \
-                                      .query(coords_r, 1)
+                # (we only use each tree once so don't bother balancing it, and
+                # query it in parallel)
+                if use_kdtree:
+                    dist_l, lcol = spatial.cKDTree(coords_l @ left,
+                                                   balanced_tree=False,
+                                                   compact_nodes=False) \
+                                          .query(coords_l, 1, **_query_jobs)
+                    dist_r, rcol = spatial.cKDTree(coords_r @ right,
+                                                   balanced_tree=False,
+                                                   compact_nodes=False) \
+                                          .query(coords_r, 1, **_query_jobs)
+                else:
+                    dist_l, lcol = _nearest_neighbors(coords_l,
+                                                      coords_l @ left)
+                    dist_r, rcol = _nearest_neighbors(coords_r,
+                                                      coords_r @ right)
                 ccost = dist_l.sum() + dist_r.sum()
 
             # generate resampling vector
             resampled[inds_l] = inds[inds_l][lcol]
             resampled[inds_r] = inds[inds_r][rcol]
 
-            if check_duplicates:
-                if np.any(np.all(resampled[:, None] == spinsamples[:, :n], 0)):
-                    duplicated = True
-                elif np.all(resampled == inds):
-                    duplicated = True
+            if check_duplicates and resampled.tobytes() in seen:
+                duplicated = True
 
         # if we broke out because we tried 500 rotations and couldn't generate
         # a new one, just warn that we're using duplicate rotations and give up
@@ -702,5 +1043,10 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
 
         spinsamples[:, n] = resampled
         cost[n] = ccost
+        seen.add(resampled.tobytes())
 
     return spinsamples, cost
+
+
+if use_numba:
+    _nearest_neighbors = njit(_nearest_neighbors, parallel=True)
@@ -113,6 +113,28 @@ def test_fetch_connectome(tmpdir, dataset, expected):
         assert isinstance(connectome[key], str if key == 'ref' else np.ndarray)
 
 
+def test_fetch_mirchi2018(tmpdir):
+    # pre-populate data directory so we don't need to generate the dataset
+    names = ['negative', 'positive']
+    data_dir = os.path.join(str(tmpdir), 'ds-mirchi2018')
+    os.makedirs(data_dir)
+    np.save(os.path.join(data_dir, 'myconnectome_fc.npy'),
+            np.random.rand(5, 3))
+    np.savetxt(os.path.join(data_dir, 'myconnectome_panas.csv'),
+               np.arange(10).reshape(5, 2), header=','.join(names),
+               delimiter=',', fmt='%i')
+
+    X, Y = datasets.fetch_mirchi2018(data_dir=tmpdir, verbose=0)
+    assert X.shape == (5, 3)
+    assert len(Y) == 5 and list(Y.dtype.names) == names
+
+    X, Y, ynames = datasets.fetch_mirchi2018(data_dir=tmpdir, verbose=0,
+                                             return_structured=False)
+    assert X.shape == (5, 3) and ynames == names
+    assert Y.shape == (5, 2) and Y.dtype == float and Y.flags.c_contiguous
+    assert np.all(Y == np.arange(10).reshape(5, 2))
+
+
 @pytest.mark.parametrize('dset, expected', [
     ('atl-cammoun2012', ['volume', 'surface', 'gcs']),
     ('tpl-conte69', ['url', 'md5']),
@@ -6,6 +6,7 @@ For testing netneurotools.stats functionality
 import itertools
 import numpy as np
 import pytest
+from scipy import optimize, spatial
 
 from netneurotools import datasets, stats
 
@@ -29,20 +30,13 @@ def test_permtest_rel():
     rvs1_2D = np.array([rvs1, rvs2])
     rvs2_2D = np.array([rvs2, rvs1])
 
-    # the p-values in these two cases should be consistent
+    # the p-values in these three cases should be consistent
     d, p = stats.permtest_rel(rvs1, rvs2, axis=0, seed=1234)
     assert np.allclose([d, p], (dr, pr))
     d, p = stats.permtest_rel(rvs1_2D.T, rvs2_2D.T, axis=0, seed=1234)
     assert np.allclose([d, p], dpr)
-
-    # but the p-value will differ here because of _how_ we're drawing the
-    # random permutations... it would be nice if this was consistent, but as
-    # yet i don't have a great idea on how to make that happen without assuming
-    # a whole lot about the data
-    pr = 0.51248751
-    tpr = ([dr, -dr], [pr, pr])
     d, p = stats.permtest_rel(rvs1_2D, rvs2_2D, axis=1, seed=1234)
-    assert np.allclose([d, p], tpr)
+    assert np.allclose([d, p], dpr)
 
 
 def test_permtest_pearsonr():
@@ -66,6 +60,46 @@ def test_permtest_pearsonr():
     assert np.allclose(r, np.array([0.50004037, 0.89927523]))
     assert np.allclose(p, np.array([0.000999, 0.000999]))
 
+    # resampling arrays can repeat samples
+    x, y = datasets.make_correlated_xy(corr=0.1, size=100)
+    resamples = np.random.randint(100, size=(100, 100))
+    null = [stats.efficient_pearsonr(x[res], y)[0] for res in resamples.T]
+    r, p = stats.permtest_pearsonr(x, y, n_perm=100, resamples=resamples)
+    assert np.isclose(p, (1 + np.sum(np.abs(null) >= np.abs(r))) / 101)
+
+
+def test_permtest_early_stop():
+    rs = np.random.RandomState(1234)
+    x, y = rs.normal(size=(2, 50, 20))
+    x[:, :5] += 2
+    y[:, :5] += x[:, :5]
+
+    for func, args in [(stats.permtest_1samp, (x, 0)),
+                       (stats.permtest_rel, (x, y)),
+                       (stats.permtest_pearsonr, (x, y))]:
+        stat, pval = func(*args)
+        estat, epval = func(*args, early_stop_thresh=0.05)
+        assert np.allclose(stat, estat)
+
+        # tests that stop early are non-significant, and the rest are the same
+        stopped = epval > 0.05
+        assert stopped.any() and not stopped.all()
+        assert np.all(pval[stopped] > 0.05)
+        assert np.allclose(pval[~stopped], epval[~stopped])
+
+
+def test_permtest_dtype():
+    rs = np.random.RandomState(1234)
+    x, y = rs.normal(size=(2, 50, 20))
+
+    for func, args in [(stats.permtest_1samp, (x, 0)),
+                       (stats.permtest_rel, (x, y)),
+                       (stats.permtest_pearsonr, (x, y))]:
+        stat, pval = func(*args)
+        sstat, spval = func(*args, dtype=np.float32)
+        assert np.allclose(stat, sstat)
+        assert np.allclose(pval, spval, atol=0.01)
+
 
 @pytest.mark.parametrize('x, y, expected', [
     # basic one-dimensional input
@@ -111,6 +145,21 @@ def test_gen_rotation():
         assert r.max() < 1 and r.min() > -1 and l.max() < 1 and l.min() > -1
 
 
+def test_gen_rotations_batch():
+    rotl, rotr = stats._gen_rotations_batch(5, seed=1234)
+    assert rotl.shape == rotr.shape == (5, 3, 3)
+
+    # batches are drawn in the same order as successive single rotations
+    rs = np.random.RandomState(1234)
+    for left, right in zip(rotl, rotr):
+        lout, rout = stats._gen_rotation(seed=rs)
+        assert np.allclose(left, lout) and np.allclose(right, rout)
+
+    # all rotations are proper (i.e., orthonormal w/o reflection)
+    assert np.allclose(rotl @ rotl.transpose(0, 2, 1), np.eye(3))
+    assert np.allclose(np.linalg.det(rotl), 1)
+
+
 def _get_sphere_coords(s, t, r=1):
     """ Gets coordinates at angles `s` and `t` a sphere of radius `r`
     """
@@ -170,3 +219,20 @@ def test_gen_spinsamples():
     # TODO: should this be allowed?
     with pytest.raises(ValueError):
         stats.gen_spinsamples(coords[hemi == 0], hemi[hemi == 0])
+
+
+def test_exact_assignment():
+    coords = np.column_stack(_get_sphere_coords(
+        *np.random.RandomState(1234).uniform(0, 360, size=(2, 200))))
+    rotl, _ = stats._gen_rotation(seed=1234)
+    rotated = coords @ rotl
+
+    dist = spatial.distance_matrix(coords, rotated)
+    expected = dist[optimize.linear_sum_assignment(dist)].sum()
+
+    # small `max_dense` and `k` force the nearest neighbor assignment (if
+    # available) and have it grow the number of considered neighbors
+    col, cost = stats._exact_assignment(coords, rotated, max_dense=10, k=2)
+    assert len(np.unique(col)) == len(col) == len(coords)
+    assert np.isclose(cost, dist[np.arange(len(coords)), col].sum())
+    assert np.isclose(cost, expected, rtol=0.05)
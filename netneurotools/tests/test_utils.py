@@ -22,6 +22,11 @@ def test_add_triu():
     arr = np.arange(9).reshape(3, 3)
     assert np.all(utils.get_triu(arr) == np.array([1, 2, 5]))
     assert np.all(utils.get_triu(arr, k=0) == np.array([0, 1, 2, 4, 5, 8]))
+    assert np.all(utils.get_triu(arr, k=-1) == np.array([0, 1, 2, 3, 4, 5,
+                                                         7, 8]))
+    # non-square arrays are fine, too
+    arr = np.arange(8).reshape(2, 4)
+    assert np.all(utils.get_triu(arr) == np.array([1, 2, 3, 6, 7]))
 
 
 @pytest.mark.parametrize('scale, expected', [
@@ -3,9 +3,11 @@
 Miscellaneous functions of various utility
 """
 
+import functools
 import glob
 import os
 import subprocess
+import tempfile
 
 import nibabel as nib
 import numpy as np
@@ -42,7 +44,17 @@ def add_constant(data):
     """
 
     data = check_array(data, ensure_2d=False)
-    return np.column_stack([data, np.ones(len(data))])
+    if data.ndim == 1:
+        data = data[:, None]
+
+    # fill a single output array rather than stacking `data` with an array of
+    # ones (the dtype matches what stacking with float ones would give)
+    out = np.empty((len(data), data.shape[1] + 1),
+                   dtype=np.result_type(data, np.float64))
+    out[:, :-1] = data
+    out[:, -1] = 1
+
+    return out
 
 
 def get_triu(data, k=1):
@@ -71,7 +83,38 @@ def get_triu(data, k=1):
     array([0.5 , 0.25, 0.33])
     """
 
-    return data[np.triu_indices(len(data), k=k)].copy()
+    # indexing with a boolean mask is much quicker than with the index arrays
+    # from np.triu_indices (and already returns a copy)
+    data = np.asarray(data)
+
+    return data[_triu_mask(*data.shape[:2], k=k)]
+
+
+@functools.lru_cache(maxsize=32)
+def _triu_mask(n_rows, n_cols, k=1):
+    """
+    Returns boolean mask of upper triangle of (`n_rows`, `n_cols`) array
+
+    Masks are cached (and read-only) since `get_triu` is often called many
+    times on arrays of the same shape
+
+    Parameters
+    ----------
+    n_rows, n_cols : int
+        Shape of array
+    k : int, optional
+        Which diagonal to select from (where primary diagonal is 0). Default: 1
+
+    Returns
+    -------
+    mask : (`n_rows`, `n_cols`) numpy.ndarray
+        Boolean mask where True indicates the upper triangle
+    """
+
+    mask = ~np.tri(n_rows, n_cols, k=k - 1, dtype=bool)
+    mask.setflags(write=False)
+
+    return mask
 
 
 def globpath(*args):
@@ -89,7 +132,7 @@ def globpath(*args):
         Sorted list of files
     """
 
-    return sorted(glob.glob(os.path.join(*args)))
+    return sorted(glob.iglob(os.path.join(*args)))
 
 
 def rescale(data, low=0, high=1):
@@ -119,12 +162,13 @@ def rescale(data, low=0, high=1):
 
 def run(cmd, env=None, return_proc=False, quiet=False):
     """
-    Runs `cmd` via shell subprocess with provided environment `env`
+    Runs `cmd` via subprocess with provided environment `env`
 
     Parameters
     ----------
-    cmd : str
-        Command to be run as single string
+    cmd : str or list of str
+        Command to be run. If a single string, `cmd` is run via the shell;
+        otherwise, it is treated as an argument list and run directly
     env : dict, optional
         If provided, dictionary of key-value pairs to be added to base
         environment when running `cmd`. Default: None
@@ -153,19 +197,32 @@ def run(cmd, env=None, return_proc=False, quiet=False):
     'hello world\\n'
     """
 
-    merged_env = os.environ.copy()
+    # the subprocess inherits our environment unless we need to add to it
+    merged_env = None
     if env is not None:
         if not isinstance(env, dict):
             raise TypeError('Provided `env` must be a dictionary, not {}'
                             .format(type(env)))
-        merged_env.update(env)
-
-    opts = {}
-    if quiet:
-        opts = dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    proc = subprocess.run(cmd, env=merged_env, shell=True, check=True,
-                          universal_newlines=True, **opts)
+        merged_env = {**os.environ, **env}
+
+    opts = dict(env=merged_env, shell=isinstance(cmd, str))
+
+    # only capture output if we're going to return it; otherwise, discard it.
+    # output is captured to temporary files rather than pipes so that verbose
+    # commands never block waiting for us to read from the pipe
+    if quiet and return_proc:
+        with tempfile.TemporaryFile('w+') as out, \
+                tempfile.TemporaryFile('w+') as err:
+            proc = subprocess.run(cmd, stdout=out, stderr=err, **opts)
+            out.seek(0)
+            err.seek(0)
+            proc.stdout, proc.stderr = out.read(), err.read()
+        proc.check_returncode()
+    elif quiet:
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, check=True, **opts)
+    else:
+        proc = subprocess.run(cmd, check=True, **opts)
 
     if return_proc:
         return proc
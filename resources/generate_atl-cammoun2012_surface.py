@@ -10,10 +10,11 @@ That is, the files returned with:
 were created with this script.
 """
 
-import glob
+from concurrent.futures import ThreadPoolExecutor
 import os
 import os.path as op
 import re
+import shlex
 import shutil
 
 from netneurotools import datasets, freesurfer
@@ -89,27 +90,51 @@ def combine_cammoun_500(lhannot, rhannot, subject_id, annot=None,
                                  '{}.cammoun500.labels'.format(hemi))
         os.makedirs(label_dir, exist_ok=True)
 
-        ctab = pd.DataFrame(columns=range(5))
-        for fn in annotfiles:
-            run(tolabel.format(subject_id=subject_id, hemi=hemi,
-                               label_dir=label_dir, annot=fn,
-                               subjects_dir=subjects_dir),
-                quiet=quiet)
-
-            # save ctab information from annotation file
-            vtx, ct, names = nib.freesurfer.read_annot(fn)
-            data = np.column_stack([[f.decode() for f in names], ct[:, :-1]])
-            ctab = ctab.append(pd.DataFrame(data), ignore_index=True)
+        # convert the annotation files to labels in parallel; each gets its
+        # own output directory because some labels appear in more than one
+        # file, and then we move them all together (in order, so that later
+        # files overwrite earlier ones)
+        out_dirs = [os.path.join(label_dir, str(n))
+                    for n in range(len(annotfiles))]
+        for out_dir in out_dirs:
+            os.makedirs(out_dir, exist_ok=True)
+        # (we also need the ctab information from the annotation files, so
+        # read those in at the same time)
+        with ThreadPoolExecutor(max_workers=2 * len(annotfiles)) as executor:
+            procs = [executor.submit(run, shlex.split(tolabel.format(
+                subject_id=subject_id, hemi=hemi, label_dir=out_dir,
+                annot=fn, subjects_dir=subjects_dir)), quiet=quiet)
+                for fn, out_dir in zip(annotfiles, out_dirs)]
+            annots = [executor.submit(nib.freesurfer.read_annot, fn)
+                      for fn in annotfiles]
+            for proc in procs:
+                proc.result()
+        for out_dir in out_dirs:
+            for entry in os.scandir(out_dir):
+                os.replace(entry.path, os.path.join(label_dir, entry.name))
+            os.rmdir(out_dir)
+
+        # save ctab information from annotation files
+        names, colors = [], []
+        for annotation in annots:
+            vtx, ct, fnames = annotation.result()
+            names.extend(f.decode() for f in fnames)
+            colors.append(ct[:, :-1])
 
         # get rid of duplicate entries and add back in unknown/corpuscallosum
-        ctab = ctab.drop_duplicates(subset=[0], keep=False)
-        add_back = pd.DataFrame([['unknown', 25, 5, 25, 0],
-                                 ['corpuscallosum', 120, 70, 50, 0]],
-                                index=[0, 4])
-        ctab = ctab.append(add_back).sort_index().reset_index(drop=True)
+        # at their original positions
+        names, colors = np.array(names), np.vstack(colors)
+        _, inverse, counts = np.unique(names, return_inverse=True,
+                                       return_counts=True)
+        keep = np.flatnonzero(counts[inverse] == 1)
+        order = np.argsort(np.append(keep, [0, 4]), kind='stable')
+        names = np.append(names[keep], ['unknown', 'corpuscallosum'])[order]
+        colors = np.vstack([colors[keep], [[25, 5, 25, 0],
+                                           [120, 70, 50, 0]]])[order]
+        ctab = np.column_stack([np.arange(len(names)), names, colors])
         # save ctab to temporary file for creation of annotation file
         ctab_fname = os.path.join(label_dir, '{}.cammoun500.ctab'.format(hemi))
-        ctab.to_csv(ctab_fname, header=False, sep='\t', index=True)
+        np.savetxt(ctab_fname, ctab, fmt='%s', delimiter='\t')
 
         # get all labels EXCEPT FOR UNKNOWN to combine into annotation
         # unknown will be regenerated as all the unmapped vertices
@@ -117,11 +142,13 @@ def combine_cammoun_500(lhannot, rhannot, subject_id, annot=None,
                          .format(os.path.join(label_dir,
                                               '{hemi}.{lab}.label'
                                               .format(hemi=hemi, lab=lab)))
-                          for lab in ctab.iloc[1:, 0]])
+                          for lab in names[1:]])
         # combine labels into annotation file
-        run(toannot.format(subjects_dir=subjects_dir, subject_id=subject_id,
-                           label_dir=label_dir, hemi=hemi, ctab=ctab_fname,
-                           annot=out, label=label),
+        run(shlex.split(toannot.format(subjects_dir=subjects_dir,
+                                       subject_id=subject_id,
+                                       label_dir=label_dir, hemi=hemi,
+                                       ctab=ctab_fname, annot=out,
+                                       label=label)),
             quiet=quiet)
         created.append(out)
 
@@ -134,52 +161,64 @@ def combine_cammoun_500(lhannot, rhannot, subject_id, annot=None,
 FSUBJ = 'fsaverage'
 ANNOT = 'atl-Cammoun2012_space-{}_res-{}_hemi-{}_deterministic.annot'
 ANNOT = ANNOT.format(FSUBJ, '{}', '{}')
+GCS = re.compile(r'res-(.*)_hemi-([RL])')
 
 if __name__ == '__main__':
     #####
     # get the GCS files and apply them onto the fsaverage surface
+    # (keep track of the files we create so we don't have to search for them)
     gcs = datasets.fetch_cammoun2012('gcs')
+    created = {}
     for scale, gcsfiles in gcs.items():
         for fn in gcsfiles:
-            hemi = re.search('hemi-([RL])', fn).group(1)
-            scale = re.search('res-(.*)_hemi-', fn).group(1)
+            scale, hemi = GCS.search(fn).groups()
             out = op.join(op.dirname(fn), ANNOT.format(scale, hemi))
             freesurfer.apply_prob_atlas(FSUBJ, fn, hemi.lower() + 'h',
                                         ctab=fn.replace('.gcs', '.ctab'),
                                         annot=out)
+            created[scale, hemi] = out
 
     #####
     # get scale 500 parcellation files and combine
     dirname = op.dirname(fn)
-    lh = sorted(glob.glob(op.join(dirname, ANNOT.format('500*', 'L'))))
-    rh = sorted(glob.glob(op.join(dirname, ANNOT.format('500*', 'R'))))
+    lh, rh = [sorted(fn for (scale, hemi), fn in created.items()
+                     if scale.startswith('500') and hemi == h)
+              for h in ['L', 'R']]
     annot500 = op.join(dirname, ANNOT.format('500', '{}'))
     parc500 = combine_cammoun_500(lh, rh, FSUBJ, annot=annot500)
+    created['500', 'L'], created['500', 'R'] = parc500
     for fn in lh + rh:
         os.remove(fn)
 
     #####
     # map all the WRONG .annot files to the correct ordering
     info = pd.read_csv(datasets.fetch_cammoun2012('volume')['info'])
+    info = info.groupby(['scale', 'structure'])
     for scale in ['033', '060', '125', '250', '500']:
-        annots = sorted(glob.glob(op.join(dirname, ANNOT.format(scale, '*'))))
-        scinfo = info.query(f'scale == "scale{scale}" & structure == "cortex"')
+        annots = [created[scale, hemi] for hemi in ['L', 'R']]
+        scinfo = info.get_group((f'scale{scale}', 'cortex'))
         scinfo = scinfo.groupby('hemisphere')
         scinfo = [scinfo.get_group(m) for m in scinfo.groups]
         for annot, hemi in zip(annots, scinfo):
             labels, ctab, names = nib.freesurfer.read_annot(annot)
             ulab = np.unique(labels)
-            idx = [names.index(n) for n in [b'unknown', b'corpuscallosum']]
-            names = [n.decode() for n in names]
-            ids = list(hemi['id'])
-            targets = list(hemi['label'])
-            inds = [names.index(x) for x in targets]
-            for i in idx:
-                inds = np.insert(inds, i, i)
-            names = [n.encode() for n in np.array(names)[inds]]
+            idx = sorted(names.index(n)
+                         for n in [b'unknown', b'corpuscallosum'])
+            targets = hemi['label'].to_numpy()
+            lookup = {name: n for n, name in enumerate(names)}
+            inds = np.fromiter((lookup[x.encode()] for x in targets),
+                               dtype=int, count=len(targets))
+            # insert all at once (offsetting by the number of entries inserted
+            # before each one) so that each index ends up at its own position
+            inds = np.insert(inds, np.subtract(idx, np.arange(len(idx))), idx)
+            names = [names[i] for i in inds]
             ctab = ctab[inds]
             src, tar = np.array(inds), np.arange(len(names))
             sidx = src.argsort()
             src, tar = src[sidx], tar[sidx]
-            labels = tar[np.searchsorted(src, labels)]
+            # there are only a few hundred distinct labels, so map each one
+            # once and then use that as a lookup table for all the vertices
+            low = labels.min()
+            lut = tar[np.searchsorted(src, np.arange(low, labels.max() + 1))]
+            labels = lut[labels - low]
             nib.freesurfer.write_annot(annot, labels, ctab, names)